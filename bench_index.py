@@ -0,0 +1,50 @@
+import os
+import time
+import logging
+import tempfile
+import statistics
+import numpy as np
+from index import SVD_COMPONENTS, ShardedIndex
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+NUM_ROWS = 200000
+
+def benchmark_index(num_rows: int = NUM_ROWS, dim: int = SVD_COMPONENTS, repeats: int = 50, top_k: int = 20):
+    """
+    Time searches over a synthetic index scanned as 1 shard in-process and as 2, 4, ... up to
+    one shard per core, and report the latency and speedup of each shard count.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((num_rows, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries = rng.standard_normal((repeats, dim), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    cores = len(os.sched_getaffinity(0))
+    shard_counts = sorted({1, cores} | {2 ** i for i in range(1, cores.bit_length()) if 2 ** i < cores})
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        ShardedIndex.from_vectors(np.arange(num_rows), vectors, index_dir, num_shards=1).close()
+        baseline_ms = None
+        for num_shards in shard_counts:
+            index = ShardedIndex(index_dir, num_shards=num_shards)
+            try:
+                # The first search starts the shard workers and faults in the mapped pages
+                index.search_vector(queries[0], top_k)
+                times = []
+                for query in queries:
+                    start = time.perf_counter()
+                    index.search_vector(query, top_k)
+                    times.append(time.perf_counter() - start)
+            finally:
+                index.close()
+
+            mean_ms = statistics.mean(times) * 1000
+            baseline_ms = baseline_ms or mean_ms
+            logger.info(f"{num_shards} shard(s): {mean_ms:.3f} ms/query, p95 {sorted(times)[int(0.95 * (len(times) - 1))] * 1000:.3f} ms, "
+                        f"speedup {baseline_ms / mean_ms:.2f}x over {num_rows} rows x {dim} dims")
+
+if __name__ == "__main__":
+    benchmark_index()
@@ -0,0 +1,67 @@
+import time
+import logging
+import statistics
+from transformers import T5Tokenizer
+from database import get_all_chunks, get_chunk_token_ids, get_query_history
+from tokens import TOKENIZER_NAME, build_inputs, check_consistency, get_fast_tokenizer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERIES = [
+    "What happens at the event horizon of a black hole?",
+    "How could quantum computers change cryptography?",
+    "Is time travel possible according to physics?",
+]
+CHUNKS_PER_QUERY = 2
+
+def benchmark_tokenization(repeats: int = 20, chunks_per_query: int = CHUNKS_PER_QUERY):
+    """
+    Time prompt assembly three ways: re-tokenizing the context string with the slow tokenizer,
+    re-tokenizing it with the fast tokenizer, and fetching the token ids cached at ingestion.
+    The fast re-tokenization separates the gain of switching tokenizers from the gain of caching.
+    """
+    chunks = get_all_chunks()
+    if not chunks:
+        logger.error("No chunks in the database; run load_files_to_db() first.")
+        return
+
+    slow = T5Tokenizer.from_pretrained(TOKENIZER_NAME)
+    fast = get_fast_tokenizer()
+    mismatches = check_consistency([text for _, text in chunks], slow_tokenizer=slow, fast_tokenizer=fast)
+
+    queries = [record[1] for record in get_query_history()] or DEFAULT_QUERIES
+    texts = dict(chunks)
+    chunk_ids = list(texts)
+
+    slow_times, fast_times, cached_times = [], [], []
+    for i in range(repeats):
+        query = queries[i % len(queries)]
+        selected = [chunk_ids[(i + j) % len(chunk_ids)] for j in range(chunks_per_query)]
+        context = ' '.join(texts[chunk_id] for chunk_id in selected)[:1000]
+
+        start = time.perf_counter()
+        slow(query + context, return_tensors="pt")
+        slow_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        fast(query + context, return_tensors="pt")
+        fast_times.append(time.perf_counter() - start)
+
+        # The database read is part of the cached path, so it is timed with it
+        start = time.perf_counter()
+        cached = get_chunk_token_ids(selected)
+        build_inputs(fast(query, add_special_tokens=False)['input_ids'], [cached[chunk_id] for chunk_id in selected], fast.eos_token_id)
+        cached_times.append(time.perf_counter() - start)
+
+    slow_ms = statistics.mean(slow_times) * 1000
+    fast_ms = statistics.mean(fast_times) * 1000
+    cached_ms = statistics.mean(cached_times) * 1000
+    logger.info(f"Consistency: {len(chunks) - len(mismatches)}/{len(chunks)} chunks match the slow tokenizer.")
+    logger.info(f"Slow re-tokenization: {slow_ms:.3f} ms/query")
+    logger.info(f"Fast re-tokenization: {fast_ms:.3f} ms/query")
+    logger.info(f"Cached ids (fetch + assembly): {cached_ms:.3f} ms/query")
+    logger.info(f"Saved by the fast tokenizer: {slow_ms - fast_ms:.3f} ms/query; saved by caching: {fast_ms - cached_ms:.3f} ms/query over {repeats} queries")
+
+if __name__ == "__main__":
+    benchmark_tokenization()
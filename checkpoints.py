@@ -0,0 +1,137 @@
+import os
+import json
+import mmap
+import shutil
+import tempfile
+import struct
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict
+import torch
+from transformers import GenerationConfig, T5Config, T5ForConditionalGeneration
+from generator import T5RAGWithLocalFiles
+from retriever import ensure_dir
+from database import get_model_weights_hash, save_model_version
+
+logger = logging.getLogger(__name__)
+
+SAFETENSORS_FILE = "model.safetensors"
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+def model_path(model_version: str) -> Path:
+    """Directory a model version is saved to."""
+    return Path(f"./custom_t5_rag_local_model_{model_version}")
+
+def weights_hash(model: torch.nn.Module) -> str:
+    """Content hash of a model's weights, covering tensor names, shapes, dtypes and bytes."""
+    digest = hashlib.blake2b(digest_size=32)
+    seen = set()
+    for name, tensor in sorted(model.state_dict().items()):
+        # Tied weights appear under several names but are hashed once
+        if tensor.data_ptr() in seen:
+            continue
+        seen.add(tensor.data_ptr())
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode('utf-8'))
+        digest.update(tensor.detach().contiguous().cpu().reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+def save_checkpoint(model: T5RAGWithLocalFiles, model_version: str) -> bool:
+    """
+    Save a model version as safetensors, skipping the write when the weights match the hash
+    recorded for that version in the models table. Returns True if the checkpoint was written.
+    """
+    save_path = model_path(model_version)
+    current_hash = weights_hash(model.generator)
+    if (save_path / SAFETENSORS_FILE).exists() and get_model_weights_hash(model_version) == current_hash:
+        logger.info(f"Model version {model_version} is unchanged; skipping save.")
+        return False
+
+    ensure_dir(save_path)
+    # Write next to the target and move the files in, so processes that have the old weights mapped
+    # keep reading the old file instead of one that is being rewritten under them
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{save_path.name}.", dir=save_path.parent))
+    try:
+        model.generator.save_pretrained(tmp_dir, safe_serialization=True)
+        model.tokenizer.save_pretrained(tmp_dir)
+        # The weights go last, so a loader that sees the new weights also sees the new config
+        for path in sorted(tmp_dir.iterdir(), key=lambda path: path.name == SAFETENSORS_FILE):
+            os.replace(path, save_path / path.name)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    save_model_version(model_version, weights_hash=current_hash, path=str(save_path))
+    logger.info(f"Model and tokenizer saved at {save_path}.")
+    return True
+
+def mmap_safetensors(file_path: Path) -> Dict[str, torch.Tensor]:
+    """
+    Map a safetensors file and return tensors that view the mapping directly, without copying.
+
+    The mapping is private copy-on-write, so every process loading the same file shares the
+    page-cache pages until it writes to a tensor.
+    """
+    with file_path.open('rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    header_length = struct.unpack('<Q', mapped[:8])[0]
+    header = json.loads(mapped[8:8 + header_length])
+    data_start = 8 + header_length
+
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        if begin == end:
+            tensors[name] = torch.empty(info["shape"], dtype=dtype)
+            continue
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        # frombuffer keeps a reference to the mapping, so it stays open as long as the tensors live
+        tensors[name] = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin).view(info["shape"])
+    return tensors
+
+def load_checkpoint(save_path: Path) -> T5ForConditionalGeneration:
+    """
+    Load a saved model version with its weights memory-mapped from model.safetensors.
+    Checkpoints saved in another format fall back to from_pretrained.
+    """
+    save_path = Path(save_path)
+    weights_file = save_path / SAFETENSORS_FILE
+    if not weights_file.exists():
+        logger.warning(f"No {SAFETENSORS_FILE} in {save_path}; loading with from_pretrained.")
+        return T5ForConditionalGeneration.from_pretrained(save_path)
+
+    # Build the module on the meta device so no weights are allocated before the mapped ones are attached
+    config = T5Config.from_pretrained(save_path)
+    with torch.device("meta"):
+        model = T5ForConditionalGeneration(config)
+    if (save_path / "generation_config.json").exists():
+        model.generation_config = GenerationConfig.from_pretrained(save_path)
+
+    for name, tensor in mmap_safetensors(weights_file).items():
+        module_name, _, attribute = name.rpartition('.')
+        module = model.get_submodule(module_name)
+        if attribute in module._parameters:
+            module._parameters[attribute] = torch.nn.Parameter(tensor, requires_grad=False)
+        elif attribute in module._buffers:
+            module._buffers[attribute] = tensor
+        else:
+            logger.warning(f"Ignoring unexpected tensor {name} in {weights_file}.")
+    model.tie_weights()
+
+    missing = [name for name, tensor in list(model.named_parameters()) + list(model.named_buffers()) if tensor.is_meta]
+    if missing:
+        raise RuntimeError(f"Checkpoint {weights_file} is missing weights: {', '.join(missing)}")
+    model.eval()
+    return model
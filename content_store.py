@@ -0,0 +1,170 @@
+import os
+import mmap
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+from retriever import ensure_dir
+
+logger = logging.getLogger(__name__)
+
+# Directory holding the append-only segment files and the size at which a new segment is started
+SEGMENT_DIR = Path(os.getenv("MORTYRAG_SEGMENT_DIR", "./segments/"))
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+# Segments whose live data falls below this fraction of their size are rewritten by compact()
+COMPACT_MIN_LIVE_RATIO = 0.5
+# Target chunk size in bytes; chunks are cut at whitespace so they may be slightly shorter
+CHUNK_BYTES = 1000
+
+def chunk_spans(data: bytes, chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """
+    Split UTF-8 encoded text into (offset, length) spans of at most chunk_bytes,
+    preferring whitespace boundaries and never cutting through a multi-byte character.
+    """
+    spans, start, total = [], 0, len(data)
+    while start < total:
+        end = min(start + chunk_bytes, total)
+        if end < total:
+            cut = max(data.rfind(b' ', start, end), data.rfind(b'\n', start, end))
+            if cut > start:
+                end = cut + 1
+            else:
+                while end > start and (data[end] & 0xC0) == 0x80:
+                    end -= 1
+        spans.append((start, end - start))
+        start = end
+    return spans
+
+class ContentStore:
+    """
+    Append-only segment files for document text, read back through mmap.
+
+    The SQLite database only records where each document lives (segment id, byte offset
+    and length); the text itself is stored in the segment files. Reads slice the mapped
+    file, so fetching a chunk copies only that chunk and hot segments are shared through
+    the page cache by every process reading them.
+
+    Appends are serialized across processes by the SQLite write lock: append() and compact()
+    start the caller's transaction with BEGIN IMMEDIATE unless it already holds the lock, so
+    the offset taken from the file and the row recording it commit before another writer
+    can append. Readers that find a segment unlinked by compaction look its offsets up again.
+    """
+
+    def __init__(self, segment_dir: Path = SEGMENT_DIR, max_segment_bytes: int = SEGMENT_MAX_BYTES):
+        """
+        Args:
+            segment_dir (Path): Directory holding the segment files.
+            max_segment_bytes (int): Size after which appends roll over to a new segment.
+        """
+        self.segment_dir = Path(segment_dir)
+        self.max_segment_bytes = max_segment_bytes
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._lock = threading.Lock()
+
+    def segment_path(self, segment_id: int) -> Path:
+        """Return the file path of a segment."""
+        return self.segment_dir / f"{segment_id:08d}.seg"
+
+    def append(self, cursor: sqlite3.Cursor, data: bytes, exclude: Tuple[int, ...] = ()) -> Tuple[int, int]:
+        """
+        Append data to the active segment and return its (segment id, byte offset).
+        The segment accounting is updated through the caller's cursor, so it commits
+        together with the row that references the data.
+        """
+        self._lock_for_write(cursor)
+        segment_id = self._active_segment(cursor, len(data), exclude)
+        path = self.segment_path(segment_id)
+        with path.open('ab') as file:
+            offset = file.tell()
+            file.write(data)
+        cursor.execute("""
+            UPDATE segments SET size = ?, live_bytes = live_bytes + ? WHERE id = ?
+        """, (offset + len(data), len(data), segment_id))
+        return segment_id, offset
+
+    def release(self, cursor: sqlite3.Cursor, segment_id: int, length: int):
+        """Mark length bytes of a segment as dead so compaction can reclaim them."""
+        cursor.execute("""
+            UPDATE segments SET live_bytes = live_bytes - ? WHERE id = ?
+        """, (length, segment_id))
+
+    def read(self, segment_id: int, offset: int, length: int) -> bytes:
+        """Read length bytes at offset from a segment without touching the rest of the file."""
+        # An empty document may live in a segment that is still empty, which cannot be mapped
+        if length == 0:
+            return b''
+        with self._lock:
+            mapped = self._map(segment_id, offset + length)
+            return mapped[offset:offset + length]
+
+    def compact(self, conn: sqlite3.Connection, min_live_ratio: float = COMPACT_MIN_LIVE_RATIO) -> int:
+        """
+        Rewrite the live documents of mostly-dead segments into the active segment and
+        delete the old files. Returns the number of segments removed.
+        """
+        cursor = conn.cursor()
+        # Hold the write lock from the start so no other process appends to or compacts the same segments
+        self._lock_for_write(cursor)
+        cursor.execute("""
+            SELECT id FROM segments WHERE size > 0 AND live_bytes < size * ?
+        """, (min_live_ratio,))
+        victims = tuple(row[0] for row in cursor.fetchall())
+        if not victims:
+            conn.commit()
+            return 0
+
+        for segment_id in victims:
+            cursor.execute("""
+                SELECT id, byte_offset, byte_length FROM documents WHERE segment_id = ?
+            """, (segment_id,))
+            for document_id, offset, length in cursor.fetchall():
+                data = self.read(segment_id, offset, length)
+                new_segment_id, new_offset = self.append(cursor, data, exclude=victims)
+                cursor.execute("""
+                    UPDATE documents SET segment_id = ?, byte_offset = ? WHERE id = ?
+                """, (new_segment_id, new_offset, document_id))
+            cursor.execute("DELETE FROM segments WHERE id = ?", (segment_id,))
+        conn.commit()
+
+        # Only unlink once the new offsets are committed; processes that already mapped
+        # an old segment keep reading it until they drop the mapping, and the rest retry
+        # with the new offsets when they find the file gone.
+        for segment_id in victims:
+            self._unmap(segment_id)
+            self.segment_path(segment_id).unlink(missing_ok=True)
+        logger.info(f"Compacted {len(victims)} segment(s).")
+        return len(victims)
+
+    def _lock_for_write(self, cursor: sqlite3.Cursor):
+        """Take the database write lock unless the caller's transaction has already written, and so holds it."""
+        if not cursor.connection.in_transaction:
+            cursor.execute("BEGIN IMMEDIATE")
+
+    def _active_segment(self, cursor: sqlite3.Cursor, length: int, exclude: Tuple[int, ...]) -> int:
+        """Return the segment to append to, starting a new one when the latest is full or excluded."""
+        cursor.execute("SELECT id, size FROM segments ORDER BY id DESC LIMIT 1")
+        row = cursor.fetchone()
+        if row and row[0] not in exclude and (row[1] == 0 or row[1] + length <= self.max_segment_bytes):
+            return row[0]
+        ensure_dir(self.segment_dir)
+        cursor.execute("INSERT INTO segments (size, live_bytes) VALUES (0, 0)")
+        return cursor.lastrowid
+
+    def _map(self, segment_id: int, min_size: int) -> mmap.mmap:
+        """Return a read-only mapping of a segment, remapping if it is shorter than min_size. Caller holds the lock."""
+        mapped = self._maps.get(segment_id)
+        if mapped is None or len(mapped) < min_size:
+            if mapped is not None:
+                mapped.close()
+            with self.segment_path(segment_id).open('rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment_id] = mapped
+        return mapped
+
+    def _unmap(self, segment_id: int):
+        """Drop the mapping of a segment."""
+        with self._lock:
+            mapped = self._maps.pop(segment_id, None)
+            if mapped is not None:
+                mapped.close()
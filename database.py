@@ -2,12 +2,18 @@ import os
 import sqlite3
 from pathlib import Path
 from retriever import read_local_file
+from content_store import ContentStore, chunk_spans
+from tokens import encode_texts, get_fast_tokenizer, pack_token_ids, token_width, unpack_token_ids
+from dedup import DUPLICATE_THRESHOLD, band_keys, minhash_signature, pack_signature, similarity, unpack_signature
 from sklearn.feature_extraction.text import TfidfVectorizer
 
 # Get the database path from the environment variable
 DB_PATH = os.getenv("SQLITE_DB_PATH", "./mortrag.db")
 RAW_DATA_DIR = Path('./data/raw/')
 
+# Document text lives in append-only segment files; SQLite only keeps the offsets
+content_store = ContentStore()
+
 def initialize_db():
     """Initialize the SQLite database and create necessary tables."""
     with sqlite3.connect(DB_PATH) as conn:
@@ -28,6 +34,9 @@ def initialize_db():
                 saved_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # Content hash and location of the safetensors checkpoint of each saved version
+        _add_column_if_missing(cursor, "models", "weights_hash", "TEXT")
+        _add_column_if_missing(cursor, "models", "path", "TEXT")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS documents (
                 id INTEGER PRIMARY KEY,
@@ -37,8 +46,69 @@ def initialize_db():
                 last_updated DATETIME DEFAULT CURRENT_TIMESTAMP
             )
         """)
+        # Location of the document text in the content store
+        _add_column_if_missing(cursor, "documents", "segment_id", "INTEGER")
+        _add_column_if_missing(cursor, "documents", "byte_offset", "INTEGER")
+        _add_column_if_missing(cursor, "documents", "byte_length", "INTEGER")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                size INTEGER NOT NULL DEFAULT 0,
+                live_bytes INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # Chunk offsets are relative to the start of their document, so compaction only moves documents
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id INTEGER NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                byte_offset INTEGER NOT NULL,
+                byte_length INTEGER NOT NULL,
+                UNIQUE (document_id, chunk_index)
+            )
+        """)
+        # Token ids of each chunk, computed once at ingestion
+        _add_column_if_missing(cursor, "chunks", "token_ids", "BLOB")
+        _add_column_if_missing(cursor, "chunks", "token_width", "INTEGER")
+        # MinHash signature of each chunk; near-duplicates point at their canonical chunk
+        _add_column_if_missing(cursor, "chunks", "minhash", "BLOB")
+        _add_column_if_missing(cursor, "chunks", "canonical_id", "INTEGER")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_canonical ON chunks (canonical_id)")
+        # LSH band buckets of canonical chunks, used to find duplicate candidates without a full scan
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS lsh_buckets (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                chunk_id INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_lsh_buckets ON lsh_buckets (band, bucket)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS rerank_cache (
+                query_hash TEXT NOT NULL,
+                chunk_id INTEGER NOT NULL,
+                model_version TEXT NOT NULL,
+                score REAL NOT NULL,
+                PRIMARY KEY (query_hash, chunk_id, model_version)
+            )
+        """)
+        # Bumped whenever the set of chunks changes, so an index built from an older set can be detected
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS corpus_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO corpus_state (id, version) VALUES (1, 0)")
         conn.commit()
 
+def _add_column_if_missing(cursor, table: str, column: str, definition: str):
+    """Add a column to an existing table created by an older version of the schema."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
 def save_query(query: str, file_path: str, result: str):
     """Save the query and result to the database."""
     with sqlite3.connect(DB_PATH) as conn:
@@ -49,23 +119,44 @@ def save_query(query: str, file_path: str, result: str):
         """, (query, file_path, result))
         conn.commit()
 
-def get_query_history():
-    """Retrieve all query history from the database."""
+def get_query_history(max_id: int = None):
+    """Retrieve all query history from the database, optionally only the queries up to max_id."""
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM queries ORDER BY timestamp DESC")
+        if max_id is None:
+            cursor.execute("SELECT * FROM queries ORDER BY timestamp DESC")
+        else:
+            cursor.execute("SELECT * FROM queries WHERE id <= ? ORDER BY timestamp DESC", (max_id,))
         return cursor.fetchall()
 
-def save_model_version(model_version: str):
-    """Save the model version to the database."""
+def get_max_query_id():
+    """Id of the most recently recorded query, or None if there are none."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT MAX(id) FROM queries")
+        return cursor.fetchone()[0]
+
+def save_model_version(model_version: str, weights_hash: str = None, path: str = None):
+    """Save the model version to the database, with the hash of its weights and where they are stored."""
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO models (model_version)
-            VALUES (?)
-        """, (model_version,))
+            INSERT INTO models (model_version, weights_hash, path)
+            VALUES (?, ?, ?)
+        """, (model_version, weights_hash, path))
         conn.commit()
 
+def get_model_weights_hash(model_version: str):
+    """Retrieve the weights hash recorded by the most recent save of a model version."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT weights_hash FROM models WHERE model_version = ?
+            ORDER BY saved_at DESC, id DESC LIMIT 1
+        """, (model_version,))
+        result = cursor.fetchone()
+        return result[0] if result else None
+
 def get_model_versions():
     """Retrieve all saved model versions from the database."""
     with sqlite3.connect(DB_PATH) as conn:
@@ -79,47 +170,208 @@ def tokenize_and_vectorize(text):
     vector = vectorizer.fit_transform([text]).toarray()[0]
     return vector
 
-def load_files_to_db():
-    """Load all supported files from /data/raw/ into the database."""
+def load_files_to_db() -> bool:
+    """
+    Load all supported files from /data/raw/ into the database and content store.
+    Returns True if any chunks were written, i.e. the retrieval index needs a rebuild.
+    """
+    changed = False
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
 
         # Process each supported file type in the /data/raw/ directory
         for file_path in RAW_DATA_DIR.glob('*.txt'):
             content = read_local_file(file_path)
-            vector = tokenize_and_vectorize(content)
-            
+            data = content.encode('utf-8')
+
             # Check if the document is already in the database
             cursor.execute("""
-                SELECT COUNT(*) FROM documents WHERE filename = ?
+                SELECT id, segment_id, byte_offset, byte_length FROM documents WHERE filename = ?
             """, (file_path.name,))
-            exists = cursor.fetchone()[0]
+            existing = cursor.fetchone()
 
-            if exists:
-                # Update the content if it already exists
+            if existing and _read_stored(existing[1], existing[2], existing[3]) == data:
+                # Unchanged documents are not rewritten, so segments only grow on real edits
+                cursor.execute("""
+                    SELECT COUNT(*) FROM chunks WHERE document_id = ? AND (token_ids IS NULL OR minhash IS NULL)
+                """, (existing[0],))
+                if cursor.fetchone()[0]:
+                    _write_chunks(cursor, existing[0], data)
+                    changed = True
+                continue
+
+            vector = tokenize_and_vectorize(content)
+            segment_id, offset = content_store.append(cursor, data)
+
+            if existing:
+                # Update the content if it already exists, releasing the old copy for compaction
+                document_id = existing[0]
+                if existing[1] is not None:
+                    content_store.release(cursor, existing[1], existing[3])
                 cursor.execute("""
                     UPDATE documents
-                    SET content = ?, vector = ?, last_updated = CURRENT_TIMESTAMP
-                    WHERE filename = ?
-                """, (content, vector, file_path.name))
+                    SET content = NULL, vector = ?, segment_id = ?, byte_offset = ?, byte_length = ?,
+                        last_updated = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                """, (vector, segment_id, offset, len(data), document_id))
             else:
                 # Insert new content
                 cursor.execute("""
-                    INSERT INTO documents (filename, content, vector)
-                    VALUES (?, ?, ?)
-                """, (file_path.name, content, vector))
-        
+                    INSERT INTO documents (filename, vector, segment_id, byte_offset, byte_length)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (file_path.name, vector, segment_id, offset, len(data)))
+                document_id = cursor.lastrowid
+
+            _write_chunks(cursor, document_id, data)
+            changed = True
+
         conn.commit()
+        content_store.compact(conn)
+    return changed
 
-def get_document_content(filename: str):
-    """Retrieve content of a specific document from the database."""
+def delete_document(filename: str) -> bool:
+    """
+    Remove a document and its chunks, releasing its content for compaction.
+    Returns True if the document existed, i.e. the retrieval index needs a rebuild.
+    """
     with sqlite3.connect(DB_PATH) as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            SELECT content FROM documents WHERE filename = ?
+            SELECT id, segment_id, byte_length FROM documents WHERE filename = ?
         """, (filename,))
         result = cursor.fetchone()
-        return result[0] if result else None
+        if not result:
+            return False
+        document_id, segment_id, length = result
+        if segment_id is not None:
+            content_store.release(cursor, segment_id, length)
+        _delete_chunks(cursor, document_id)
+        cursor.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+        conn.commit()
+        content_store.compact(conn)
+    return True
+
+def _write_chunks(cursor, document_id: int, data: bytes):
+    """
+    Replace the chunk table entries of a document with spans over its new content, their
+    token ids and MinHash signatures. Chunks that nearly duplicate an existing canonical chunk
+    are recorded with a back-reference to it and left out of the LSH buckets and retrieval index.
+    """
+    spans = chunk_spans(data)
+    texts = [data[offset:offset + length].decode('utf-8') for offset, length in spans]
+    width = token_width(len(get_fast_tokenizer()))
+    token_ids = encode_texts(texts)
+    _delete_chunks(cursor, document_id)
+
+    for index, ((offset, length), text, ids) in enumerate(zip(spans, texts, token_ids)):
+        signature = minhash_signature(text)
+        keys = band_keys(signature)
+        canonical_id = _find_duplicate(cursor, signature, keys)
+        cursor.execute("""
+            INSERT INTO chunks (document_id, chunk_index, byte_offset, byte_length, token_ids, token_width, minhash, canonical_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (document_id, index, offset, length, pack_token_ids(ids, width), width, pack_signature(signature), canonical_id))
+        if canonical_id is None:
+            _insert_buckets(cursor, cursor.lastrowid, keys)
+
+def _find_duplicate(cursor, signature, keys):
+    """Return the id of the most similar canonical chunk above DUPLICATE_THRESHOLD, or None."""
+    conditions = " OR ".join("(b.band = ? AND b.bucket = ?)" for _ in keys)
+    cursor.execute(f"""
+        SELECT DISTINCT c.id, c.minhash FROM lsh_buckets b JOIN chunks c ON c.id = b.chunk_id
+        WHERE {conditions}
+    """, [value for band, key in enumerate(keys) for value in (band, key)])
+    best_id, best_similarity = None, DUPLICATE_THRESHOLD
+    for chunk_id, blob in cursor.fetchall():
+        score = similarity(signature, unpack_signature(blob))
+        if score >= best_similarity:
+            best_id, best_similarity = chunk_id, score
+    return best_id
+
+def _insert_buckets(cursor, chunk_id: int, keys):
+    """Register a canonical chunk in the LSH buckets."""
+    cursor.executemany("""
+        INSERT INTO lsh_buckets (band, bucket, chunk_id) VALUES (?, ?, ?)
+    """, [(band, key, chunk_id) for band, key in enumerate(keys)])
+
+def _delete_chunks(cursor, document_id: int):
+    """
+    Delete the chunks of a document with their LSH buckets and cached rerank scores.
+    The oldest surviving duplicate of each removed canonical chunk is promoted in its place,
+    and the remaining duplicates are matched again against the canonical chunks.
+    """
+    # Every change to the chunk set passes through here, including the rewrite in _write_chunks
+    cursor.execute("UPDATE corpus_state SET version = version + 1 WHERE id = 1")
+    cursor.execute("""
+        SELECT id FROM chunks WHERE document_id = ? AND canonical_id IS NULL
+    """, (document_id,))
+    removed = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        DELETE FROM lsh_buckets WHERE chunk_id IN (SELECT id FROM chunks WHERE document_id = ?)
+    """, (document_id,))
+    cursor.execute("""
+        DELETE FROM rerank_cache WHERE chunk_id IN (SELECT id FROM chunks WHERE document_id = ?)
+    """, (document_id,))
+    cursor.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+
+    for chunk_id in removed:
+        cursor.execute("""
+            SELECT id, minhash FROM chunks WHERE canonical_id = ? ORDER BY id
+        """, (chunk_id,))
+        orphans = cursor.fetchall()
+        if not orphans:
+            continue
+        # The oldest duplicate takes the removed chunk's place
+        heir_id, heir_blob = orphans[0]
+        cursor.execute("UPDATE chunks SET canonical_id = NULL WHERE id = ?", (heir_id,))
+        _insert_buckets(cursor, heir_id, band_keys(unpack_signature(heir_blob)))
+        # The others were close to the removed chunk, not necessarily to the heir, so each is matched
+        # again and becomes canonical itself if nothing is similar enough any more
+        for orphan_id, blob in orphans[1:]:
+            signature = unpack_signature(blob)
+            keys = band_keys(signature)
+            canonical_id = _find_duplicate(cursor, signature, keys)
+            cursor.execute("UPDATE chunks SET canonical_id = ? WHERE id = ?", (canonical_id, orphan_id))
+            if canonical_id is None:
+                _insert_buckets(cursor, orphan_id, keys)
+
+def _read_stored(segment_id, offset, length):
+    """Read stored bytes from the content store, or None if they are missing."""
+    if segment_id is None:
+        return None
+    try:
+        return content_store.read(segment_id, offset, length)
+    except (OSError, ValueError):
+        return None
+
+def _document_text(row):
+    """Decode a (content, segment_id, byte_offset, byte_length) row, falling back to legacy inline content."""
+    if not row:
+        return None
+    content, segment_id, offset, length = row
+    if segment_id is None:
+        return content
+    return content_store.read(segment_id, offset, length).decode('utf-8')
+
+def _read_located(cursor, query: str, params, read):
+    """
+    Run a query locating stored content and return read(cursor). Compaction in another process may
+    move the content and unlink its segment between the lookup and the read; the lookup is then
+    repeated once, as the committed offsets already point at the new copy.
+    """
+    try:
+        cursor.execute(query, params)
+        return read(cursor)
+    except FileNotFoundError:
+        cursor.execute(query, params)
+        return read(cursor)
+
+def get_document_content(filename: str):
+    """Retrieve content of a specific document from the database."""
+    with sqlite3.connect(DB_PATH) as conn:
+        return _read_located(conn.cursor(), """
+            SELECT content, segment_id, byte_offset, byte_length FROM documents WHERE filename = ?
+        """, (filename,), lambda cursor: _document_text(cursor.fetchone()))
 
 def get_document_vector(filename: str):
     """Retrieve vector of a specific document from the database."""
@@ -129,4 +381,102 @@ def get_document_vector(filename: str):
             SELECT vector FROM documents WHERE filename = ?
         """, (filename,))
         result = cursor.fetchone()
-        return result[0] if result else None
\ No newline at end of file
+        return result[0] if result else None
+
+def get_chunk_content(chunk_id: int):
+    """Retrieve the text of a single chunk by slicing the mapped segment, without reading the whole document."""
+    def read(cursor):
+        result = cursor.fetchone()
+        if not result or result[0] is None:
+            return None
+        return content_store.read(*result).decode('utf-8')
+
+    with sqlite3.connect(DB_PATH) as conn:
+        return _read_located(conn.cursor(), """
+            SELECT d.segment_id, d.byte_offset + c.byte_offset, c.byte_length
+            FROM chunks c JOIN documents d ON d.id = c.document_id
+            WHERE c.id = ?
+        """, (chunk_id,), read)
+
+def get_corpus_version():
+    """Version of the chunk set, bumped on every change to it."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM corpus_state WHERE id = 1")
+        result = cursor.fetchone()
+        return result[0] if result else 0
+
+def get_all_chunks():
+    """Retrieve (chunk id, text) for every canonical chunk in the database; near-duplicates are left out."""
+    with sqlite3.connect(DB_PATH) as conn:
+        return _read_located(conn.cursor(), """
+            SELECT c.id, d.segment_id, d.byte_offset + c.byte_offset, c.byte_length
+            FROM chunks c JOIN documents d ON d.id = c.document_id
+            WHERE d.segment_id IS NOT NULL AND c.canonical_id IS NULL
+            ORDER BY c.document_id, c.chunk_index
+        """, (), lambda cursor: [(chunk_id, content_store.read(segment_id, offset, length).decode('utf-8'))
+                                 for chunk_id, segment_id, offset, length in cursor.fetchall()])
+
+def get_rerank_scores(query_hash: str, model_version: str, chunk_ids):
+    """Retrieve cached rerank scores for a query as a {chunk id: score} dict."""
+    chunk_ids = list(chunk_ids)
+    if not chunk_ids:
+        return {}
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        placeholders = ", ".join("?" for _ in chunk_ids)
+        cursor.execute(f"""
+            SELECT chunk_id, score FROM rerank_cache
+            WHERE query_hash = ? AND model_version = ? AND chunk_id IN ({placeholders})
+        """, (query_hash, model_version, *chunk_ids))
+        return dict(cursor.fetchall())
+
+def save_rerank_scores(query_hash: str, model_version: str, scores: dict):
+    """Save rerank scores for a query, keyed by chunk id."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT OR REPLACE INTO rerank_cache (query_hash, chunk_id, model_version, score)
+            VALUES (?, ?, ?, ?)
+        """, [(query_hash, chunk_id, model_version, score) for chunk_id, score in scores.items()])
+        conn.commit()
+
+def get_chunk_token_ids(chunk_ids):
+    """Retrieve the pre-computed token ids of chunks as a {chunk id: array} dict."""
+    chunk_ids = list(chunk_ids)
+    if not chunk_ids:
+        return {}
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        placeholders = ", ".join("?" for _ in chunk_ids)
+        cursor.execute(f"""
+            SELECT id, token_ids, token_width FROM chunks
+            WHERE id IN ({placeholders}) AND token_ids IS NOT NULL
+        """, chunk_ids)
+        return {chunk_id: unpack_token_ids(blob, width) for chunk_id, blob, width in cursor.fetchall()}
+
+def get_document_token_ids(filename: str):
+    """Retrieve the pre-computed token ids of a document as per-chunk arrays, or None if it has not been tokenized."""
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.token_ids, c.token_width FROM chunks c JOIN documents d ON d.id = c.document_id
+            WHERE d.filename = ? ORDER BY c.chunk_index
+        """, (filename,))
+        rows = cursor.fetchall()
+        if not rows or any(blob is None for blob, _ in rows):
+            return None
+        return [unpack_token_ids(blob, width) for blob, width in rows]
+
+def get_chunk_signatures(chunk_ids):
+    """Retrieve the MinHash signatures of chunks as a {chunk id: signature} dict."""
+    chunk_ids = list(chunk_ids)
+    if not chunk_ids:
+        return {}
+    with sqlite3.connect(DB_PATH) as conn:
+        cursor = conn.cursor()
+        placeholders = ", ".join("?" for _ in chunk_ids)
+        cursor.execute(f"""
+            SELECT id, minhash FROM chunks WHERE id IN ({placeholders}) AND minhash IS NOT NULL
+        """, chunk_ids)
+        return {chunk_id: unpack_signature(blob) for chunk_id, blob in cursor.fetchall()}
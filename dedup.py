@@ -0,0 +1,68 @@
+import re
+import zlib
+import hashlib
+from typing import Dict, List, Sequence
+import numpy as np
+
+# Signature layout: NUM_BANDS bands of ROWS_PER_BAND rows. Chunks sharing any band become
+# candidates, which for 16 x 8 happens with ~50% probability at a Jaccard similarity of 0.7
+NUM_PERM = 128
+NUM_BANDS = 16
+ROWS_PER_BAND = NUM_PERM // NUM_BANDS
+# Estimated Jaccard similarity at which a chunk is collapsed into an existing canonical chunk
+DUPLICATE_THRESHOLD = 0.85
+# Lower threshold for dropping redundant passages when the prompt context is assembled
+CONTEXT_DUPLICATE_THRESHOLD = 0.7
+SHINGLE_WORDS = 5
+
+# Universal hashing h(x) = (a * x + b) mod p over 32-bit shingle hashes. The seed is fixed
+# so signatures stored by earlier ingestions stay comparable.
+_PRIME = np.uint64(4294967311)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 2 ** 32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 2 ** 32, size=NUM_PERM, dtype=np.uint64)
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> List[str]:
+    """Overlapping word n-grams of the lowercased text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature of the text's shingle set as NUM_PERM uint32 values."""
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in set(shingles(text))), dtype=np.uint64)
+    # a, x < 2**32 so a * x + b stays below 2**64
+    permuted = (np.outer(hashes, _A) + _B) % _PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+def band_keys(signature: np.ndarray) -> List[int]:
+    """One signed 64-bit bucket key per band, suitable for an indexed SQLite column."""
+    return [
+        int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8).digest(), 'little', signed=True)
+        for band in signature.reshape(NUM_BANDS, ROWS_PER_BAND)
+    ]
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(first == second))
+
+def pack_signature(signature: np.ndarray) -> bytes:
+    """Serialize a signature for storage."""
+    return signature.astype('<u4').tobytes()
+
+def unpack_signature(blob: bytes) -> np.ndarray:
+    """Deserialize a signature stored by pack_signature."""
+    return np.frombuffer(blob, dtype='<u4')
+
+def suppress_near_duplicates(chunk_ids: Sequence[int], signatures: Dict[int, np.ndarray], threshold: float = CONTEXT_DUPLICATE_THRESHOLD) -> List[int]:
+    """Keep chunk_ids in order, dropping any chunk too similar to one already kept."""
+    kept = []
+    for chunk_id in chunk_ids:
+        signature = signatures.get(chunk_id)
+        if signature is not None and any(
+            kept_id in signatures and similarity(signature, signatures[kept_id]) >= threshold for kept_id in kept
+        ):
+            continue
+        kept.append(chunk_id)
+    return kept
@@ -1,10 +1,13 @@
 import torch
 import logging
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+import numpy as np
+from transformers import T5Tokenizer, T5TokenizerFast, T5ForConditionalGeneration
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 from retriever import read_local_file
-from database import get_document_content  # Import the function to retrieve document content
+from database import get_document_content, get_document_token_ids  # Import the functions to retrieve document content
+from tokens import is_compatible
+from profiling import profiled
 
 logger = logging.getLogger(__name__)
 
@@ -13,13 +16,13 @@ class T5RAGWithLocalFiles(torch.nn.Module):
     Integrates the T5 model with local file data for enhanced text generation.
     """
 
-    def __init__(self, generator: T5ForConditionalGeneration, tokenizer: T5Tokenizer):
+    def __init__(self, generator: T5ForConditionalGeneration, tokenizer: Union[T5Tokenizer, T5TokenizerFast]):
         """
         Initializes the T5RAGWithLocalFiles model.
 
         Args:
             generator (T5ForConditionalGeneration): The pre-trained T5 model for text generation.
-            tokenizer (T5Tokenizer): The tokenizer associated with the T5 model.
+            tokenizer (Union[T5Tokenizer, T5TokenizerFast]): The tokenizer associated with the T5 model.
         """
         super(T5RAGWithLocalFiles, self).__init__()
         self.generator = generator
@@ -36,6 +39,7 @@ class T5RAGWithLocalFiles(torch.nn.Module):
             logger.critical(f"Forward pass failed: {e}")
             raise
 
+    @profiled("T5RAGWithLocalFiles.generate")
     def generate(
         self,
         input_ids: torch.Tensor,
@@ -60,9 +64,17 @@ class T5RAGWithLocalFiles(torch.nn.Module):
             if file_path:
                 file_content = read_local_file(file_path)
             
-            # If no file path is provided but a filename is, read from the database
+            # If no file path is provided but a filename is, use the token ids stored at ingestion
+            # and only fall back to tokenizing the database content when they are unavailable
             elif filename:
-                file_content = get_document_content(filename)
+                cached_ids = get_document_token_ids(filename) if is_compatible(self.tokenizer) else None
+                if cached_ids:
+                    ids = np.concatenate(cached_ids)[:self.tokenizer.model_max_length - 1].astype(np.int64)
+                    file_ids = torch.from_numpy(np.append(ids, self.tokenizer.eos_token_id)).unsqueeze(0)
+                    input_ids = torch.cat((input_ids, file_ids), dim=-1)
+                    attention_mask = torch.cat((attention_mask, torch.ones_like(file_ids)), dim=-1)
+                else:
+                    file_content = get_document_content(filename)
             
             if file_content:
                 file_content_tokens = self.tokenizer(file_content, return_tensors="pt", truncation=True, padding=True)
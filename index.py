@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import heapq
+import pickle
+import shutil
+import logging
+import multiprocessing
+from itertools import chain
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from threadpoolctl import threadpool_limits
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
+from retriever import ensure_dir
+from database import get_all_chunks, get_corpus_version
+
+logger = logging.getLogger(__name__)
+
+# Location of the on-disk retrieval index and the number of shards it is split into
+INDEX_DIR = Path(os.getenv("MORTYRAG_INDEX_DIR", "./index/"))
+NUM_SHARDS = int(os.getenv("MORTYRAG_NUM_SHARDS", os.cpu_count() or 1))
+SVD_COMPONENTS = 256
+# Below this many rows a single in-process scan beats the cost of dispatching to workers
+PARALLEL_MIN_ROWS = 50000
+
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+MODEL_FILE = "model.pkl"
+META_FILE = "meta.json"
+# Names the generation directory holding the live index; replaced atomically on rebuild
+CURRENT_FILE = "CURRENT"
+GENERATION_PREFIX = "gen-"
+
+# Per-worker view of the vectors file, opened once by the pool initializer
+_worker_vectors = None
+
+def _init_worker(vectors_path: str):
+    """Memory-map the vectors file in a pool worker so shards share the page cache."""
+    global _worker_vectors
+    # The shards already run in parallel; a multi-threaded BLAS in every worker would oversubscribe the cores
+    threadpool_limits(limits=1, user_api='blas')
+    _worker_vectors = np.load(vectors_path, mmap_mode='r')
+
+def _top_k_rows(vectors: np.ndarray, start: int, stop: int, query_vector: np.ndarray, k: int) -> List[Tuple[float, int]]:
+    """Score rows [start, stop) against the query and return the local top-k as (score, row) pairs."""
+    scores = vectors[start:stop] @ query_vector
+    if len(scores) > k:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return [(float(scores[i]), start + int(i)) for i in candidates]
+
+def _search_shard(start: int, stop: int, query_vector: np.ndarray, k: int) -> List[Tuple[float, int]]:
+    """Search a single shard from inside a pool worker."""
+    return _top_k_rows(_worker_vectors, start, stop, query_vector, k)
+
+def shard_bounds(num_rows: int, num_shards: int) -> List[Tuple[int, int]]:
+    """Split num_rows into at most num_shards contiguous, evenly sized row ranges."""
+    num_shards = max(1, min(num_shards, num_rows))
+    size, remainder = divmod(num_rows, num_shards)
+    bounds, start = [], 0
+    for shard in range(num_shards):
+        stop = start + size + (1 if shard < remainder else 0)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+class ShardedIndex:
+    """
+    Dense retrieval index stored as a single memory-mapped matrix and scanned in parallel shards.
+    """
+
+    def __init__(self, index_dir: Path = INDEX_DIR, num_shards: Optional[int] = None):
+        """
+        Opens an index previously written by ShardedIndex.build.
+
+        Args:
+            index_dir (Path): Directory holding the index files.
+            num_shards (Optional[int]): Number of shards to scan in parallel. Defaults to the value stored at build time.
+        """
+        self.index_dir = Path(index_dir)
+        generation = (self.index_dir / CURRENT_FILE).read_text(encoding='utf-8').strip()
+        self.generation_dir = self.index_dir / generation
+        with (self.generation_dir / META_FILE).open('r', encoding='utf-8') as file:
+            self.meta = json.load(file)
+        with (self.generation_dir / MODEL_FILE).open('rb') as file:
+            self.vectorizer, self.svd = pickle.load(file)
+
+        self.vectors_path = self.generation_dir / VECTORS_FILE
+        self.vectors = np.load(self.vectors_path, mmap_mode='r')
+        self.ids = np.load(self.generation_dir / IDS_FILE)
+        # Version of the chunk set the index was built from; None for indexes not built from the database
+        self.corpus_version = self.meta.get("corpus_version")
+        self.num_shards = num_shards or self.meta["num_shards"]
+        self.shards = shard_bounds(len(self.ids), self.num_shards)
+        self._pool = None
+        logger.debug(f"Opened index with {len(self.ids)} rows in {len(self.shards)} shard(s).")
+
+    @classmethod
+    def build(cls, ids: Sequence[int], texts: Sequence[str], index_dir: Path = INDEX_DIR, num_shards: int = NUM_SHARDS,
+              corpus_version: Optional[int] = None) -> "ShardedIndex":
+        """
+        Vectorize texts and write a fresh index, replacing any existing one.
+
+        Each build is written to its own generation directory and published by atomically
+        replacing the CURRENT pointer, so readers open either the old or the new index in full.
+        A corpus with no indexable terms produces an empty index.
+
+        Args:
+            ids (Sequence[int]): Identifier returned for each text on retrieval.
+            texts (Sequence[str]): Texts to index.
+            index_dir (Path): Directory to write the index files to.
+            num_shards (int): Number of shards the index is split into.
+            corpus_version (Optional[int]): Version of the chunk set the texts were read from.
+        """
+        vectorizer = TfidfVectorizer(stop_words='english')
+        try:
+            matrix = vectorizer.fit_transform(texts) if texts else None
+        except ValueError as e:
+            # Raised when every text is empty or made only of stop words
+            logger.warning(f"Nothing to index: {e}")
+            matrix = None
+
+        if matrix is None:
+            return cls.from_vectors([], np.zeros((0, 1), dtype=np.float32), index_dir, num_shards, corpus_version=corpus_version)
+        n_components = min(SVD_COMPONENTS, matrix.shape[0] - 1, matrix.shape[1] - 1)
+        svd = TruncatedSVD(n_components=n_components) if n_components > 0 else None
+        vectors = svd.fit_transform(matrix) if svd else matrix.toarray()
+        return cls.from_vectors(ids, _normalize(vectors.astype(np.float32)), index_dir, num_shards, vectorizer, svd, corpus_version)
+
+    @classmethod
+    def from_vectors(cls, ids: Sequence[int], vectors: np.ndarray, index_dir: Path = INDEX_DIR, num_shards: int = NUM_SHARDS,
+                     vectorizer: Optional[TfidfVectorizer] = None, svd: Optional[TruncatedSVD] = None,
+                     corpus_version: Optional[int] = None) -> "ShardedIndex":
+        """
+        Write already normalized vectors as a new index generation and publish it.
+
+        Args:
+            ids (Sequence[int]): Identifier returned for each row on retrieval.
+            vectors (np.ndarray): One L2-normalized float32 row per id.
+            index_dir (Path): Directory to write the index files to.
+            num_shards (int): Number of shards the index is split into.
+            vectorizer (Optional[TfidfVectorizer]): Fitted vectorizer used to embed text queries.
+            svd (Optional[TruncatedSVD]): Fitted projection applied after the vectorizer.
+            corpus_version (Optional[int]): Version of the chunk set the vectors were computed from.
+        """
+        index_dir = Path(index_dir)
+        generation = f"{GENERATION_PREFIX}{time.time_ns()}"
+        generation_dir = index_dir / generation
+        ensure_dir(generation_dir)
+        with (generation_dir / VECTORS_FILE).open('wb') as file:
+            np.save(file, vectors)
+        with (generation_dir / IDS_FILE).open('wb') as file:
+            np.save(file, np.asarray(ids, dtype=np.int64))
+        with (generation_dir / MODEL_FILE).open('wb') as file:
+            pickle.dump((vectorizer, svd), file)
+        with (generation_dir / META_FILE).open('w', encoding='utf-8') as file:
+            json.dump({"num_rows": len(ids), "dim": int(vectors.shape[1]), "num_shards": num_shards, "corpus_version": corpus_version}, file)
+
+        previous = _current_generation(index_dir)
+        tmp_current = index_dir / f"{CURRENT_FILE}.tmp"
+        tmp_current.write_text(generation, encoding='utf-8')
+        os.replace(tmp_current, index_dir / CURRENT_FILE)
+        # Keep the previous generation for readers that resolved CURRENT just before the swap,
+        # and any newer one another process may still be writing
+        for path in index_dir.glob(f"{GENERATION_PREFIX}*"):
+            if path.name not in (generation, previous) and _generation_time(path.name) < _generation_time(generation):
+                shutil.rmtree(path, ignore_errors=True)
+
+        logger.info(f"Built index of {len(ids)} rows x {vectors.shape[1]} dims in {generation_dir}.")
+        return cls(index_dir, num_shards=num_shards)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Project a query into the index vector space."""
+        vector = self.vectorizer.transform([query])
+        vector = self.svd.transform(vector) if self.svd else vector.toarray()
+        return _normalize(vector.astype(np.float32))[0]
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Return the top_k (id, score) pairs for the query, best first.
+        """
+        if len(self.ids) == 0:
+            return []
+        return self.search_vector(self.embed_query(query), top_k)
+
+    def search_vector(self, query_vector: np.ndarray, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Return the top_k (id, score) pairs for an already embedded query, best first.
+        """
+        if len(self.ids) == 0:
+            return []
+        # Daemonic processes, such as model workers, may not start a pool of their own
+        parallel = len(self.shards) > 1 and len(self.ids) >= PARALLEL_MIN_ROWS
+        if parallel and not multiprocessing.current_process().daemon:
+            pool = self._get_pool()
+            futures = [pool.submit(_search_shard, start, stop, query_vector, top_k) for start, stop in self.shards]
+            candidates = chain.from_iterable(future.result() for future in futures)
+        else:
+            candidates = _top_k_rows(self.vectors, 0, len(self.ids), query_vector, top_k)
+
+        return [(int(self.ids[row]), score) for score, row in heapq.nlargest(top_k, candidates)]
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """Start the shard worker pool on first use."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=len(self.shards),
+                initializer=_init_worker,
+                initargs=(str(self.vectors_path),),
+            )
+        return self._pool
+
+    def close(self):
+        """Shut down the shard worker pool."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+def _current_generation(index_dir: Path) -> Optional[str]:
+    """Name of the generation directory CURRENT points at, if any."""
+    try:
+        return (index_dir / CURRENT_FILE).read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+
+def _generation_time(name: str) -> int:
+    """Creation time in nanoseconds encoded in a generation directory name."""
+    try:
+        return int(name[len(GENERATION_PREFIX):])
+    except ValueError:
+        return 0
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so a dot product equals cosine similarity."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+_index: Optional[ShardedIndex] = None
+
+def rebuild_index(num_shards: int = NUM_SHARDS) -> ShardedIndex:
+    """Rebuild the retrieval index from the chunks table, rebalancing shards over the new corpus."""
+    global _index
+    # Read the version first, so changes made while the chunks are read leave the index marked stale
+    corpus_version = get_corpus_version()
+    chunks = get_all_chunks()
+    if _index is not None:
+        _index.close()
+    _index = ShardedIndex.build(
+        [chunk_id for chunk_id, _ in chunks],
+        [text for _, text in chunks],
+        num_shards=num_shards,
+        corpus_version=corpus_version,
+    )
+    return _index
+
+def get_index() -> ShardedIndex:
+    """
+    Return the process-wide index. It is opened from disk when the published generation matches
+    the current chunk set, and rebuilt only when the chunks changed since it was built.
+    """
+    global _index
+    corpus_version = get_corpus_version()
+    if _index is not None and _index.corpus_version == corpus_version:
+        return _index
+    if _index is not None:
+        _index.close()
+        _index = None
+    # Another process may already have published an index of the current chunks
+    if _current_generation(INDEX_DIR) is not None:
+        _index = ShardedIndex(INDEX_DIR, num_shards=NUM_SHARDS)
+        if _index.corpus_version == corpus_version:
+            return _index
+        logger.info(f"Index was built from chunk set version {_index.corpus_version}, now {corpus_version}; rebuilding.")
+    return rebuild_index()
+
+def retrieve_documents(query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+    """Retrieve the top_k most similar chunks as (chunk id, cosine similarity) pairs."""
+    return get_index().search(query, top_k=top_k)
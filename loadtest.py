@@ -0,0 +1,262 @@
+import os
+import sys
+import copy
+import json
+import math
+import time
+import random
+import sqlite3
+import logging
+import argparse
+import threading
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from database import DB_PATH, get_max_query_id, get_query_history
+from generator import T5RAGWithLocalFiles
+from rag import generate_answer, load_model
+from retriever import ensure_dir
+from worker_pool import ModelWorkerPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+REPORT_DIR = Path('./loadtest_reports/')
+SYNTHETIC_QUERIES = [
+    "What happens at the event horizon of a black hole?",
+    "How could quantum computers change cryptography?",
+    "Is time travel possible according to physics?",
+    "Who were the gods of thunder in mythology?",
+    "What is the derivative of x squared?",
+    "How has science fiction influenced technology?",
+]
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """Mean, p50, p95, p99 and max of a list of durations."""
+    return {
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+def rss_bytes(pid: int) -> int:
+    """Resident set size of a process, read from /proc."""
+    try:
+        with open(f"/proc/{pid}/statm") as file:
+            return int(file.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+def load_queries(source: str, limit: Optional[int], max_id: Optional[int] = None) -> List[str]:
+    """
+    Queries to replay: recorded traffic from the queries table up to max_id, or the synthetic mix.
+    Pinning max_id keeps repeated runs replaying the same workload.
+    """
+    if source == "replay":
+        # get_query_history is newest first; replay in the order the traffic arrived
+        queries = [record[1] for record in reversed(get_query_history(max_id))]
+        if not queries:
+            logger.warning("The queries table is empty; falling back to the synthetic mix.")
+            queries = list(SYNTHETIC_QUERIES)
+    else:
+        queries = list(SYNTHETIC_QUERIES)
+    if limit:
+        queries = [queries[i % len(queries)] for i in range(limit)]
+    return queries
+
+class Sampler(threading.Thread):
+    """Background thread that samples RSS and SQLite write-lock waits at a fixed interval."""
+
+    def __init__(self, interval: float, pids: Callable[[], List[int]]):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.pids = pids
+        self.rss: List[Dict[str, float]] = []
+        self.lock_waits: List[float] = []
+        self.lock_timeouts = 0
+        self._stop_event = threading.Event()
+        self._start = time.perf_counter()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.rss.append({
+                "t": time.perf_counter() - self._start,
+                "bytes": sum(rss_bytes(pid) for pid in self.pids()),
+            })
+            self._probe_lock()
+
+    def _probe_lock(self):
+        """Time how long a writer waits for the database write lock."""
+        try:
+            conn = sqlite3.connect(DB_PATH, timeout=self.interval, isolation_level=None)
+            try:
+                start = time.perf_counter()
+                conn.execute("BEGIN IMMEDIATE")
+                self.lock_waits.append(time.perf_counter() - start)
+                conn.execute("ROLLBACK")
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            self.lock_timeouts += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+def run_load_test(queries: List[str], rate: float, concurrency: int, answer: Callable[[str], str], pids: Callable[[], List[int]], sample_interval: float = 1.0) -> Dict:
+    """
+    Send queries with Poisson arrivals at rate per second (0 sends them all at once),
+    with at most concurrency in flight, and collect latency, queueing, RSS and lock-wait metrics.
+    """
+    records = []
+    records_lock = threading.Lock()
+
+    def run_one(query: str, arrival: float):
+        start = time.perf_counter()
+        ok, error = True, None
+        try:
+            answer(query)
+        except Exception as e:
+            ok, error = False, str(e)
+        end = time.perf_counter()
+        with records_lock:
+            records.append({"queue": start - arrival, "service": end - start, "latency": end - arrival, "ok": ok, "error": error})
+
+    sampler = Sampler(sample_interval, pids)
+    sampler.start()
+    begin = time.perf_counter()
+    arrival = begin
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for query in queries:
+            if rate > 0:
+                arrival += random.expovariate(rate)
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                arrival = time.perf_counter()
+            executor.submit(run_one, query, arrival)
+    duration = time.perf_counter() - begin
+    sampler.stop()
+
+    ok = [record for record in records if record["ok"]]
+    rss = [sample["bytes"] for sample in sampler.rss]
+    return {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "duration_s": duration,
+        "throughput_rps": len(ok) / duration if duration else 0.0,
+        "latency_s": summarize([record["latency"] for record in ok]),
+        "queue_delay_s": summarize([record["queue"] for record in records]),
+        "service_s": summarize([record["service"] for record in ok]),
+        "rss": {
+            "start_bytes": rss[0] if rss else None,
+            "end_bytes": rss[-1] if rss else None,
+            "peak_bytes": max(rss) if rss else None,
+            "growth_bytes": rss[-1] - rss[0] if rss else None,
+            "samples": sampler.rss,
+        },
+        "sqlite_lock_wait_s": dict(summarize(sampler.lock_waits), timeouts=sampler.lock_timeouts, probes=len(sampler.lock_waits) + sampler.lock_timeouts),
+        "error_messages": sorted({record["error"] for record in records if record["error"]}),
+    }
+
+def compare_reports(baseline: Dict, current: Dict) -> List[str]:
+    """Human-readable deltas of the headline metrics between two reports."""
+    lines = []
+    for section, key in [("throughput_rps", None), ("latency_s", "p50"), ("latency_s", "p95"), ("latency_s", "p99"),
+                         ("queue_delay_s", "p95"), ("rss", "growth_bytes"), ("sqlite_lock_wait_s", "p95")]:
+        old = baseline["results"][section] if key is None else baseline["results"][section].get(key)
+        new = current["results"][section] if key is None else current["results"][section].get(key)
+        name = section if key is None else f"{section}.{key}"
+        if old is None or new is None:
+            lines.append(f"{name}: {old} -> {new}")
+        else:
+            change = f" ({(new - old) / old * 100:+.1f}%)" if old else ""
+            lines.append(f"{name}: {old:.4f} -> {new:.4f}{change}")
+    return lines
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic queries against generate_answer and report latency, throughput and resource use.")
+    parser.add_argument("--source", choices=["replay", "synthetic"], default="replay", help="Replay the queries table or use the synthetic query mix.")
+    parser.add_argument("--limit", type=int, default=None, help="Number of requests to send (cycles through the queries).")
+    parser.add_argument("--rate", type=float, default=1.0, help="Mean arrival rate in requests per second; 0 sends everything at once.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum requests in flight.")
+    parser.add_argument("--mode", choices=["inprocess", "pool", "reload"], default="inprocess",
+                        help="inprocess: one shared model; pool: ModelWorkerPool; reload: load the model on every request.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of model workers in pool mode.")
+    parser.add_argument("--replay-until", type=int, default=None,
+                        help="Replay only queries with an id up to this one (defaults to the newest query when the run starts).")
+    parser.add_argument("--context-source", choices=["file", "database"], default="database")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="Seconds between RSS and lock-wait samples.")
+    parser.add_argument("--output", type=Path, default=None, help="Report path (defaults to loadtest_reports/<timestamp>.json).")
+    parser.add_argument("--compare", type=Path, default=None, help="Earlier report to compare against.")
+    args = parser.parse_args(argv)
+
+    if args.source == "replay" and args.replay_until is None:
+        args.replay_until = get_max_query_id()
+    queries = load_queries(args.source, args.limit, args.replay_until)
+    # Load-test traffic is not recorded, so it neither feeds later replays nor adds writes to the lock-wait numbers
+    request_kwargs = {"context_source": args.context_source, "speak": False, "record_query": False}
+    pool = None
+
+    if args.mode == "pool":
+        pool = ModelWorkerPool(args.workers)
+        answer = lambda query: pool.generate_answer(query, **request_kwargs)
+        pids = lambda: [os.getpid()] + pool.pids()
+    elif args.mode == "reload":
+        answer = lambda query: generate_answer(query, **request_kwargs)
+        pids = lambda: [os.getpid()]
+    else:
+        model = load_model()
+        # Fast tokenizers are not safe to share between threads, so each thread gets its own copy around the shared weights
+        local = threading.local()
+
+        def answer(query: str) -> str:
+            if not hasattr(local, "model"):
+                local.model = T5RAGWithLocalFiles(model.generator, copy.deepcopy(model.tokenizer))
+            return generate_answer(query, model=local.model, **request_kwargs)
+        pids = lambda: [os.getpid()]
+
+    logger.info(f"Sending {len(queries)} request(s) at {args.rate}/s with concurrency {args.concurrency} ({args.mode}).")
+    try:
+        results = run_load_test(queries, args.rate, args.concurrency, answer, pids, args.sample_interval)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    output = args.output or REPORT_DIR / f"loadtest_{datetime.now():%Y%m%d_%H%M%S}.json"
+    ensure_dir(output.parent)
+    with output.open('w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+    latency = results["latency_s"]
+    logger.info(f"Throughput: {results['throughput_rps']:.3f} req/s, errors: {results['errors']}/{results['requests']}")
+    logger.info(f"Latency p50/p95/p99: {latency['p50']}/{latency['p95']}/{latency['p99']} s")
+    logger.info(f"RSS growth: {results['rss']['growth_bytes']} bytes")
+    logger.info(f"Report written to {output}")
+
+    if args.compare:
+        with args.compare.open('r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        for line in compare_reports(baseline, report):
+            logger.info(line)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
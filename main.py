@@ -2,16 +2,23 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
 import logging
+import time
+from random import random
 from pathlib import Path
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+from transformers import T5ForConditionalGeneration, T5TokenizerFast
 from generator import T5RAGWithLocalFiles
 from retriever import read_local_file
 from database import initialize_db, load_files_to_db, save_query, get_query_history
+from index import rebuild_index
 from rag import generate_answer
+from worker_pool import MODEL_WORKERS, ModelWorkerPool
+import profiling
 
-# Initialize database and load files into it
+# Initialize database, load files into it and rebuild the retrieval index if the chunks changed;
+# otherwise get_index() opens the published one on the first query
 initialize_db()
-load_files_to_db()
+if load_files_to_db():
+    rebuild_index()
 
 # Configure logging
 logging.basicConfig(filename='app.log', level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -109,12 +116,13 @@ class Optimizer:
         """Run the optimization process."""
         try:
             t5_rag_local_model = T5RAGWithLocalFiles(self.generator, self.tokenizer)
+            # The prompt does not change between iterations, so it is tokenized once
+            file_content = read_local_file(Path(file_path)) if file_path else ""
+            inputs = self.tokenizer(query + file_content, return_tensors="pt", truncation=True, padding=True)
             for iteration in range(1, max_iterations + 1):
                 if not self.running:
                     break
 
-                file_content = read_local_file(Path(file_path)) if file_path else ""
-                inputs = self.tokenizer(query + file_content, return_tensors="pt", truncation=True, padding=True)
                 solution_tensor = t5_rag_local_model.generate(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask'])
                 solution = self.tokenizer.decode(solution_tensor[0], skip_special_tokens=True)
                 
@@ -147,9 +155,11 @@ class OptimizationApp:
         self.root.title("MortyRAG")
         self.root.configure(bg="#1c1c1c")
 
-        self.tokenizer = T5Tokenizer.from_pretrained("t5-base")
+        self.tokenizer = T5TokenizerFast.from_pretrained("t5-base")
         self.generator = T5ForConditionalGeneration.from_pretrained("t5-base")
         self.optimizer = Optimizer(self.generator, self.tokenizer)
+        # Serve queries from a pool of pinned model processes when MORTYRAG_MODEL_WORKERS is set
+        self.worker_pool = ModelWorkerPool(MODEL_WORKERS, model=T5RAGWithLocalFiles(self.generator, self.tokenizer)) if MODEL_WORKERS > 0 else None
         
         self.query_history = []
         self._setup_styles()
@@ -256,6 +266,20 @@ class OptimizationApp:
         self.history_button.grid(column=0, row=15, pady=5)
         ToolTip(self.history_button, "View the history of queries and results.")
 
+        self.profile_frame = ttk.LabelFrame(container, text="Profiling", padding="10", style="TLabelframe")
+        self.profile_frame.grid(column=0, row=16, sticky=(tk.W, tk.E), pady=10)
+
+        self.profile_next_button = ttk.Button(self.profile_frame, text="Profile Next Query", command=self.profile_next_query)
+        self.profile_next_button.grid(column=0, row=0, sticky=tk.W, pady=5)
+        ToolTip(self.profile_next_button, "Capture a Python and torch profile of the next query.")
+
+        self.profile_slow_var = tk.BooleanVar(value=profiling.status()["slow_ms"] is not None)
+        self.profile_slow_check = ttk.Checkbutton(
+            self.profile_frame, text="Profile Slow Queries", variable=self.profile_slow_var, command=self.toggle_slow_profiling
+        )
+        self.profile_slow_check.grid(column=1, row=0, sticky=tk.W, padx=10, pady=5)
+        ToolTip(self.profile_slow_check, f"Keep a profile of any query slower than {profiling.DEFAULT_SLOW_MS:.0f} ms.")
+
     def toggle_mode(self):
         """Toggle between Optimization Mode and Query Mode."""
         mode = self.mode_var.get()
@@ -298,7 +322,8 @@ class OptimizationApp:
         try:
             self.status_label.config(text="Status: Processing Query...")
             self.start_button.config(state=tk.DISABLED)
-            generated_text = generate_answer(query=query, file_path=Path(file_path) if file_path else None, max_length=max_length, context_source=context_source)
+            answer = self.worker_pool.generate_answer if self.worker_pool else generate_answer
+            generated_text = answer(query=query, file_path=Path(file_path) if file_path else None, max_length=max_length, context_source=context_source)
             self.show_query_result(generated_text)
             self.status_label.config(text="Status: Complete")
             self.start_button.config(state=tk.NORMAL)
@@ -346,6 +371,16 @@ class OptimizationApp:
         result_textbox.config(state=tk.DISABLED)
         result_textbox.pack(expand=True, fill="both", padx=10, pady=10)
 
+    def profile_next_query(self):
+        """Capture a profile of the next query, keeping the slow-query setting."""
+        profiling.enable(next_n=1, slow_ms=profiling.status()["slow_ms"])
+        self.status_label.config(text="Status: Profiling Next Query")
+
+    def toggle_slow_profiling(self):
+        """Switch automatic capture of slow queries on or off."""
+        slow_ms = profiling.DEFAULT_SLOW_MS if self.profile_slow_var.get() else None
+        profiling.enable(next_n=profiling.status()["remaining"], slow_ms=slow_ms)
+
     def view_history(self):
         """View query history stored in the SQLite database."""
         history = get_query_history()
@@ -0,0 +1,171 @@
+import os
+import io
+import json
+import time
+import ctypes
+import pstats
+import cProfile
+import logging
+import threading
+import multiprocessing
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+from typing import Optional, Tuple
+from torch.profiler import ProfilerActivity, profile
+from retriever import ensure_dir
+
+logger = logging.getLogger(__name__)
+
+# Where capture artifacts are written and how many rows the summaries keep
+PROFILE_DIR = Path(os.getenv("MORTYRAG_PROFILE_DIR", "./profiles/"))
+TOP_N = 25
+# Slow-request threshold used by the environment opt-in and the GUI toggle
+DEFAULT_SLOW_MS = float(os.getenv("MORTYRAG_PROFILE_SLOW_MS") or 5000)
+
+class _ProfilingState:
+    """
+    Capture settings kept in shared memory, so model workers forked from this process see
+    changes made here and draw on the same next-N budget. `active` is the only thing checked
+    on the fast path.
+    """
+
+    def __init__(self):
+        context = multiprocessing.get_context("fork")
+        self.active = context.RawValue(ctypes.c_bool, False)
+        self.remaining = context.RawValue(ctypes.c_int, 0)
+        # Negative when slow-request capture is off
+        self.slow_ms = context.RawValue(ctypes.c_double, -1.0)
+        self.lock = context.Lock()
+
+    def threshold(self) -> Optional[float]:
+        """Slow-request threshold in milliseconds, or None if it is off. Caller holds the lock."""
+        return self.slow_ms.value if self.slow_ms.value >= 0 else None
+
+_state = _ProfilingState()
+_local = threading.local()
+# torch.profiler can only run one session at a time per process
+_torch_lock = threading.Lock()
+
+def enable(next_n: int = 0, slow_ms: Optional[float] = None):
+    """
+    Turn on capture for the next next_n requests and/or for any request slower than slow_ms.
+    Takes effect immediately, without a restart, in this process and its model workers.
+    """
+    with _state.lock:
+        _state.remaining.value = max(0, next_n)
+        _state.slow_ms.value = -1.0 if slow_ms is None else max(0.0, slow_ms)
+        _state.active.value = _state.remaining.value > 0 or slow_ms is not None
+    logger.info(f"Profiling settings: next {max(0, next_n)} request(s), slow threshold {slow_ms} ms.")
+
+def disable():
+    """Turn off all capture."""
+    enable(0, None)
+
+def status() -> dict:
+    """Current capture settings."""
+    with _state.lock:
+        return {"active": _state.active.value, "remaining": _state.remaining.value, "slow_ms": _state.threshold()}
+
+def _claim() -> Optional[Tuple[bool, Optional[float]]]:
+    """
+    Decide whether this request is captured. Returns (forced, slow_ms), where forced
+    captures are always written and the rest only if they exceed slow_ms, or None.
+    """
+    with _state.lock:
+        slow_ms = _state.threshold()
+        if _state.remaining.value > 0:
+            _state.remaining.value -= 1
+            _state.active.value = _state.remaining.value > 0 or slow_ms is not None
+            return True, slow_ms
+        if slow_ms is not None:
+            return False, slow_ms
+        return None
+
+def profiled(name: str):
+    """
+    Decorator that captures a Python and torch operator profile of the wrapped call when
+    profiling is enabled. When disabled it costs a single shared-memory read.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Nested profiled calls are covered by the outer capture
+            if not _state.active.value or getattr(_local, "capturing", False):
+                return func(*args, **kwargs)
+            claim = _claim()
+            if claim is None:
+                return func(*args, **kwargs)
+            return _capture(name, claim[0], claim[1], func, args, kwargs)
+        return wrapper
+    return decorator
+
+def _capture(name: str, forced: bool, slow_ms: Optional[float], func, args, kwargs):
+    """Run func under cProfile and, if available, torch.profiler, then write the artifacts if kept."""
+    _local.capturing = True
+    torch_profiler = profile(activities=[ProfilerActivity.CPU]) if _torch_lock.acquire(blocking=False) else None
+    python_profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        if torch_profiler is not None:
+            torch_profiler.__enter__()
+        python_profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            python_profiler.disable()
+            if torch_profiler is not None:
+                torch_profiler.__exit__(None, None, None)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if forced or (slow_ms is not None and elapsed_ms >= slow_ms):
+                try:
+                    _write_capture(name, elapsed_ms, python_profiler, torch_profiler)
+                except Exception as e:
+                    logger.error(f"Failed to write profile for {name}: {e}")
+    finally:
+        if torch_profiler is not None:
+            _torch_lock.release()
+        _local.capturing = False
+
+def _write_capture(name: str, elapsed_ms: float, python_profiler: cProfile.Profile, torch_profiler):
+    """Write a timestamped capture directory with raw profiles and top-N summaries."""
+    capture_dir = PROFILE_DIR / f"{datetime.now():%Y%m%d_%H%M%S_%f}_{name}_{elapsed_ms:.0f}ms"
+    ensure_dir(capture_dir)
+
+    python_profiler.dump_stats(str(capture_dir / "python.prof"))
+    stream = io.StringIO()
+    stats = pstats.Stats(python_profiler, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_N)
+    (capture_dir / "python_top.txt").write_text(stream.getvalue(), encoding='utf-8')
+
+    top_functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_N]
+    summary = {
+        "name": name,
+        "elapsed_ms": elapsed_ms,
+        "top_functions": [
+            {"function": f"{path}:{line}({func})", "calls": calls, "cumulative_s": cumulative}
+            for (path, line, func), (_, calls, _, cumulative, _) in top_functions
+        ],
+    }
+
+    if torch_profiler is not None:
+        torch_profiler.export_chrome_trace(str(capture_dir / "torch_trace.json"))
+        averages = torch_profiler.key_averages()
+        (capture_dir / "torch_ops.txt").write_text(averages.table(sort_by="self_cpu_time_total", row_limit=TOP_N), encoding='utf-8')
+        top_ops = sorted(averages, key=lambda event: event.self_cpu_time_total, reverse=True)[:TOP_N]
+        summary["top_operators"] = [
+            {"operator": event.key, "calls": event.count, "self_cpu_ms": event.self_cpu_time_total / 1000}
+            for event in top_ops
+        ]
+
+    with (capture_dir / "summary.json").open('w', encoding='utf-8') as file:
+        json.dump(summary, file, indent=2)
+    logger.info(f"Profile of {name} ({elapsed_ms:.0f} ms) written to {capture_dir}.")
+
+# Opt in at startup through the environment; enable()/disable() change it at runtime.
+# Workers forked later share these settings, so MORTYRAG_PROFILE_NEXT counts requests across all of them
+if os.getenv("MORTYRAG_PROFILE_NEXT") or os.getenv("MORTYRAG_PROFILE_SLOW_MS"):
+    enable(
+        next_n=int(os.getenv("MORTYRAG_PROFILE_NEXT", "0")),
+        slow_ms=DEFAULT_SLOW_MS if os.getenv("MORTYRAG_PROFILE_SLOW_MS") else None,
+    )
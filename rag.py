@@ -4,14 +4,46 @@ import sys
 import re
 from pathlib import Path
 from typing import Optional
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+from transformers import T5TokenizerFast, T5ForConditionalGeneration
 from generator import T5RAGWithLocalFiles
-from retriever import ensure_dir
-from database import get_document_content, save_query
+from database import get_chunk_content, get_chunk_signatures, get_chunk_token_ids, save_query
+from dedup import suppress_near_duplicates
+from index import retrieve_documents
+from reranker import Reranker
+from tokens import build_inputs, is_compatible
+from profiling import profiled
+from checkpoints import load_checkpoint, model_path, save_checkpoint
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def load_model(model_version: str = "v1.0", load_saved_model: bool = False) -> T5RAGWithLocalFiles:
+    """
+    Load the tokenizer and generator, either the base t5-base weights or a saved model version.
+    """
+    if load_saved_model:
+        model_save_path = model_path(model_version)
+        if not model_save_path.exists():
+            logger.error(f"Model path {model_save_path} does not exist.")
+            raise FileNotFoundError(f"Model path {model_save_path} does not exist.")
+        try:
+            # Weights are memory-mapped, so processes loading the same version share their pages
+            generator = load_checkpoint(model_save_path)
+            tokenizer = T5TokenizerFast.from_pretrained(model_save_path)
+            logger.info(f"Loaded model version: {model_version} successfully.")
+        except Exception as e:
+            logger.error(f"Error loading the model: {e}")
+            raise RuntimeError(f"Error loading the model: {e}")
+    else:
+        tokenizer = T5TokenizerFast.from_pretrained("t5-base")
+        generator = T5ForConditionalGeneration.from_pretrained("t5-base")
+        logger.debug("Initialized tokenizer and generator model.")
+
+    t5_rag_local_model = T5RAGWithLocalFiles(generator=generator, tokenizer=tokenizer)
+    logger.debug("Initialized T5RAGWithLocalFiles model.")
+    return t5_rag_local_model
+
+@profiled("generate_answer")
 def generate_answer(
     query: str,
     file_path: Optional[Path] = None,
@@ -26,8 +58,14 @@ def generate_answer(
     repetition_penalty: float = 1.0,
     length_penalty: float = 1.0,
     regex_filter: Optional[str] = None,  # Optional regex filter parameter
-    context_source: str = "file"  # Can be "file" or "database"
-) -> None:
+    context_source: str = "file",  # Can be "file" or "database"
+    top_k: int = 2,  # Number of chunks retrieved from the database
+    rerank: bool = True,  # Rerank first-stage candidates with the T5 model
+    rerank_candidates: int = 20,  # Number of first-stage candidates passed to the reranker
+    model: Optional[T5RAGWithLocalFiles] = None,  # Preloaded model; loaded from disk when omitted
+    speak: bool = True,  # Read the answer aloud with espeak
+    record_query: bool = True  # Save the query and answer to the queries table
+) -> str:
     """
     Generate an answer using T5RAG with local content from files or database.
     """
@@ -36,28 +74,11 @@ def generate_answer(
             logger.error("Query cannot be empty or just whitespace.")
             raise ValueError("Query cannot be empty or just whitespace.")
 
-        tokenizer = T5Tokenizer.from_pretrained("t5-base")
-        generator = T5ForConditionalGeneration.from_pretrained("t5-base")
-        logger.debug("Initialized tokenizer and generator model.")
-
-        if load_saved_model:
-            model_save_path = Path(f"./custom_t5_rag_local_model_{model_version}")
-            if model_save_path.exists():
-                try:
-                    generator = T5ForConditionalGeneration.from_pretrained(model_save_path)
-                    tokenizer = T5Tokenizer.from_pretrained(model_save_path)
-                    logger.info(f"Loaded model version: {model_version} successfully.")
-                except Exception as e:
-                    logger.error(f"Error loading the model: {e}")
-                    raise RuntimeError(f"Error loading the model: {e}")
-            else:
-                logger.error(f"Model path {model_save_path} does not exist.")
-                raise FileNotFoundError(f"Model path {model_save_path} does not exist.")
-
-        t5_rag_local_model = T5RAGWithLocalFiles(generator=generator, tokenizer=tokenizer)
-        logger.debug("Initialized T5RAGWithLocalFiles model.")
+        t5_rag_local_model = model if model is not None else load_model(model_version, load_saved_model)
+        tokenizer = t5_rag_local_model.tokenizer
 
         context_documents = []
+        context_chunk_ids = []
 
         if context_source == "file":
             base_directory = Path('./data/raw/')
@@ -69,23 +90,44 @@ def generate_answer(
                 if len(context_documents) >= 2:  # Limit number of documents for memory efficiency
                     break
         elif context_source == "database":
-            # Load content from the database
-            document_filenames = ["your_filename_1.txt", "your_filename_2.txt"]  # replace with actual filenames or logic to fetch from DB
-            for filename in document_filenames:
-                content = get_document_content(filename)
+            # Load the most relevant chunks from the database using the sharded retrieval index,
+            # then let the T5 reranker pick the top_k of the first-stage candidates
+            first_stage = retrieve_documents(query, top_k=rerank_candidates if rerank else top_k)
+            # Drop near-duplicate passages so they neither cost rerank passes nor waste context tokens
+            first_stage_ids = [chunk_id for chunk_id, _ in first_stage]
+            distinct = set(suppress_near_duplicates(first_stage_ids, get_chunk_signatures(first_stage_ids)))
+            first_stage = [(chunk_id, score) for chunk_id, score in first_stage if chunk_id in distinct]
+            candidates = [(chunk_id, get_chunk_content(chunk_id)) for chunk_id, _ in first_stage]
+            candidates = [(chunk_id, text) for chunk_id, text in candidates if text]
+            if rerank:
+                ranked = Reranker(t5_rag_local_model, model_version=model_version if load_saved_model else "t5-base").rerank(query, candidates, top_k)
+            else:
+                ranked = first_stage
+            candidate_text = dict(candidates)
+
+            for chunk_id, score in ranked:
+                logger.debug(f"Selected chunk {chunk_id} with score {score:.4f}.")
+                content = candidate_text.get(chunk_id)
                 if content and regex_filter:
                     content = ' '.join(re.findall(regex_filter, content))
+                elif content:
+                    context_chunk_ids.append(chunk_id)
                 if content:
                     context_documents.append(content)
-                if len(context_documents) >= 2:  # Limit number of documents for memory efficiency
+                if len(context_documents) >= top_k:
                     break
         else:
             logger.error("Invalid context source specified.")
             raise ValueError("Invalid context source. Choose either 'file' or 'database'.")
 
-        combined_context = ' '.join(context_documents)[:1000]  # Limit to 1000 characters
-        
-        inputs = tokenizer(query + combined_context, return_tensors="pt")
+        cached_ids = get_chunk_token_ids(context_chunk_ids) if context_chunk_ids and is_compatible(tokenizer) else {}
+        if context_chunk_ids and len(cached_ids) == len(context_chunk_ids):
+            # Concatenate the token ids stored at ingestion instead of re-tokenizing the context
+            query_ids = tokenizer(query, add_special_tokens=False)['input_ids']
+            inputs = build_inputs(query_ids, [cached_ids[chunk_id] for chunk_id in context_chunk_ids], tokenizer.eos_token_id)
+        else:
+            combined_context = ' '.join(context_documents)[:1000]  # Limit to 1000 characters
+            inputs = tokenizer(query + combined_context, return_tensors="pt")
 
         output_sequences = t5_rag_local_model.generate(
             input_ids=inputs['input_ids'],
@@ -102,17 +144,17 @@ def generate_answer(
         generated_text = tokenizer.decode(output_sequences[0], skip_special_tokens=True)
         logger.info("Generated Answer: %s", generated_text)
 
-        os.system(f'espeak "{generated_text}"')
+        if speak:
+            os.system(f'espeak "{generated_text}"')
 
         # Save query and result to the database
-        save_query(query=query, file_path=str(file_path) if file_path else None, result=generated_text)
+        if record_query:
+            save_query(query=query, file_path=str(file_path) if file_path else None, result=generated_text)
 
         if save_model:
-            model_save_path = Path(f"./custom_t5_rag_local_model_{model_version}")
-            ensure_dir(model_save_path)
-            generator.save_pretrained(model_save_path)
-            tokenizer.save_pretrained(model_save_path)
-            logger.info(f"Model and tokenizer saved at {model_save_path}.")
+            save_checkpoint(t5_rag_local_model, model_version)
+
+        return generated_text
 
     except Exception as e:
         logger.critical(f"Failed to generate an answer: {e}")
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+from typing import List, Sequence, Tuple
+import torch
+from generator import T5RAGWithLocalFiles
+from database import get_rerank_scores, save_rerank_scores
+
+logger = logging.getLogger(__name__)
+
+# Prompt and target tokens for relevance scoring; the score is log P("true") against P("false")
+RERANK_PROMPT = "Query: {query} Document: {passage} Relevant:"
+RELEVANT_TOKEN = "true"
+IRRELEVANT_TOKEN = "false"
+
+def query_hash(query: str) -> str:
+    """Stable hash of a query used as the rerank cache key."""
+    return hashlib.sha256(query.strip().encode('utf-8')).hexdigest()
+
+class Reranker:
+    """
+    Second-stage reranker that scores (query, passage) pairs with the loaded T5 model.
+    """
+
+    def __init__(self, model: T5RAGWithLocalFiles, model_version: str = "v1.0", batch_size: int = 8, max_input_length: int = 512):
+        """
+        Initializes the Reranker.
+
+        Args:
+            model (T5RAGWithLocalFiles): The model used for scoring; no extra weights are loaded.
+            model_version (str): Model version the cached scores belong to.
+            batch_size (int): Number of pairs scored per forward pass.
+            max_input_length (int): Token limit for each (query, passage) prompt.
+        """
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.model_version = model_version
+        self.batch_size = batch_size
+        self.max_input_length = max_input_length
+        self.relevant_id = self.tokenizer.convert_tokens_to_ids(f"▁{RELEVANT_TOKEN}")
+        self.irrelevant_id = self.tokenizer.convert_tokens_to_ids(f"▁{IRRELEVANT_TOKEN}")
+        if self.tokenizer.unk_token_id in (self.relevant_id, self.irrelevant_id):
+            raise ValueError(f"Tokenizer has no single-token encoding of '{RELEVANT_TOKEN}' and '{IRRELEVANT_TOKEN}'; cannot score relevance.")
+
+    def score(self, query: str, passages: Sequence[str]) -> List[float]:
+        """
+        Score passages for relevance to the query with one decoder step per batch, no decoding.
+        """
+        scores = []
+        with torch.inference_mode():
+            for start in range(0, len(passages), self.batch_size):
+                batch = [RERANK_PROMPT.format(query=query, passage=passage) for passage in passages[start:start + self.batch_size]]
+                inputs = self.tokenizer(batch, return_tensors="pt", truncation=True, padding=True, max_length=self.max_input_length)
+                # A single target token makes the decoder produce exactly one step of logits
+                labels = torch.full((len(batch), 1), self.relevant_id, dtype=torch.long)
+                _, logits = self.model(inputs['input_ids'], attention_mask=inputs['attention_mask'], labels=labels)
+                pair_logits = logits[:, 0, [self.relevant_id, self.irrelevant_id]]
+                scores.extend(torch.log_softmax(pair_logits, dim=-1)[:, 0].tolist())
+        return scores
+
+    def rerank(self, query: str, candidates: Sequence[Tuple[int, str]], top_k: int) -> List[Tuple[int, float]]:
+        """
+        Rerank (chunk id, text) candidates and return the top_k as (chunk id, score), best first.
+        Scores are cached per (query hash, chunk id) so repeated queries skip the model.
+        """
+        if not candidates:
+            return []
+        key = query_hash(query)
+        cached = get_rerank_scores(key, self.model_version, [chunk_id for chunk_id, _ in candidates])
+        missing = [(chunk_id, text) for chunk_id, text in candidates if chunk_id not in cached]
+
+        if missing:
+            fresh = dict(zip((chunk_id for chunk_id, _ in missing), self.score(query, [text for _, text in missing])))
+            save_rerank_scores(key, self.model_version, fresh)
+            cached.update(fresh)
+        logger.debug(f"Reranked {len(candidates)} candidates ({len(missing)} scored, {len(candidates) - len(missing)} cached).")
+
+        ranked = sorted(((chunk_id, cached[chunk_id]) for chunk_id, _ in candidates), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
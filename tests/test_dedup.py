@@ -0,0 +1,47 @@
+import sqlite3
+import numpy as np
+import pytest
+import database
+from dedup import band_keys, pack_signature
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(database, "DB_PATH", path)
+    database.initialize_db()
+    return path
+
+def _insert_chunk(cursor, document_id, signature, canonical_id=None):
+    cursor.execute("""
+        INSERT INTO chunks (document_id, chunk_index, byte_offset, byte_length, minhash, canonical_id)
+        VALUES (?, 0, 0, 0, ?, ?)
+    """, (document_id, pack_signature(signature), canonical_id))
+    chunk_id = cursor.lastrowid
+    if canonical_id is None:
+        database._insert_buckets(cursor, chunk_id, band_keys(signature))
+    return chunk_id
+
+def test_deleting_canonical_chunk_rematches_orphaned_duplicates(db_path):
+    base = np.arange(128, dtype=np.uint32)
+    # Each of these is ~0.88 similar to base, but first and second are only ~0.77 similar to each other
+    first = base.copy()
+    first[:15] += 1000
+    second = base.copy()
+    second[-15:] += 2000
+    # ~0.87 similar to base and ~0.98 similar to first
+    third = first.copy()
+    third[15:17] += 3000
+
+    with sqlite3.connect(db_path) as conn:
+        cursor = conn.cursor()
+        canonical = _insert_chunk(cursor, 1, base)
+        heir = _insert_chunk(cursor, 2, first, canonical)
+        dissimilar = _insert_chunk(cursor, 3, second, canonical)
+        similar = _insert_chunk(cursor, 4, third, canonical)
+
+        database._delete_chunks(cursor, 1)
+
+        cursor.execute("SELECT id, canonical_id FROM chunks ORDER BY id")
+        assert cursor.fetchall() == [(heir, None), (dissimilar, None), (similar, heir)]
+        cursor.execute("SELECT DISTINCT chunk_id FROM lsh_buckets ORDER BY chunk_id")
+        assert [row[0] for row in cursor.fetchall()] == [heir, dissimilar]
@@ -0,0 +1,42 @@
+import multiprocessing
+import pytest
+import index
+from index import ShardedIndex
+
+TEXTS = [
+    "A black hole bends light near its event horizon.",
+    "Quantum computers could break public key cryptography.",
+    "Thor was the Norse god of thunder and storms.",
+    "The derivative of x squared is two x.",
+    "Time dilation near a black hole slows clocks.",
+    "Science fiction inspired the first mobile phones.",
+]
+QUERY = "black hole event horizon"
+
+@pytest.fixture
+def sharded_index(tmp_path, monkeypatch):
+    # Take the parallel path even for a tiny corpus
+    monkeypatch.setattr(index, "PARALLEL_MIN_ROWS", 0)
+    built = ShardedIndex.build(list(range(len(TEXTS))), TEXTS, index_dir=tmp_path, num_shards=2)
+    yield built
+    built.close()
+
+def _search(built, results):
+    try:
+        results.put(("ok", built.search(QUERY, top_k=3)))
+    except Exception as e:
+        results.put(("error", repr(e)))
+
+def test_search_in_daemonic_process_scans_in_process(sharded_index):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(target=_search, args=(sharded_index, results), daemon=True)
+    process.start()
+    status, hits = results.get(timeout=60)
+    process.join()
+
+    assert status == "ok", hits
+    assert sharded_index._pool is None
+    expected = sharded_index.search(QUERY, top_k=3)
+    assert [chunk_id for chunk_id, _ in hits] == [chunk_id for chunk_id, _ in expected]
+    assert [score for _, score in hits] == pytest.approx([score for _, score in expected])
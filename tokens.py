@@ -0,0 +1,69 @@
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+import torch
+from transformers import T5Tokenizer, T5TokenizerFast
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer used to pre-tokenize chunks at ingestion
+TOKENIZER_NAME = "t5-base"
+# Stored id arrays use the narrowest little-endian width that fits the vocabulary
+WIDTH_DTYPES = {2: np.dtype('<u2'), 4: np.dtype('<u4')}
+# Token budget for retrieved context in the prompt (T5 encoders take 512 tokens)
+MAX_CONTEXT_TOKENS = 256
+
+@lru_cache(maxsize=None)
+def get_fast_tokenizer(name: str = TOKENIZER_NAME) -> T5TokenizerFast:
+    """Load the Rust-backed fast tokenizer once per process."""
+    return T5TokenizerFast.from_pretrained(name)
+
+def is_compatible(tokenizer) -> bool:
+    """Whether ids produced by the ingestion tokenizer can be fed to a model using this tokenizer."""
+    return len(tokenizer) == len(get_fast_tokenizer())
+
+def token_width(vocab_size: int) -> int:
+    """Number of bytes used to store each token id."""
+    return 2 if vocab_size <= 2 ** 16 else 4
+
+def encode_texts(texts: Sequence[str], tokenizer: Optional[T5TokenizerFast] = None) -> List[np.ndarray]:
+    """Tokenize texts in one batch call without special tokens, so chunk ids can be concatenated."""
+    tokenizer = tokenizer or get_fast_tokenizer()
+    encoded = tokenizer(list(texts), add_special_tokens=False)['input_ids']
+    return [np.asarray(ids, dtype=np.uint32) for ids in encoded]
+
+def pack_token_ids(ids: np.ndarray, width: int) -> bytes:
+    """Serialize token ids as a compact little-endian array."""
+    return np.asarray(ids).astype(WIDTH_DTYPES[width]).tobytes()
+
+def unpack_token_ids(blob: bytes, width: int) -> np.ndarray:
+    """Deserialize token ids stored by pack_token_ids without copying."""
+    return np.frombuffer(blob, dtype=WIDTH_DTYPES[width])
+
+def build_inputs(query_ids: Sequence[int], context_ids: Sequence[np.ndarray], eos_token_id: int, max_context_tokens: int = MAX_CONTEXT_TOKENS) -> Dict[str, torch.Tensor]:
+    """
+    Assemble model inputs from the query's ids and cached chunk ids, replacing string
+    concatenation and re-tokenization of the context.
+    """
+    context = np.concatenate(context_ids)[:max_context_tokens] if context_ids else np.empty(0, dtype=np.int64)
+    ids = np.concatenate([np.asarray(query_ids, dtype=np.int64), context.astype(np.int64), [eos_token_id]])
+    input_ids = torch.from_numpy(ids).unsqueeze(0)
+    return {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+
+def check_consistency(texts: Sequence[str], slow_tokenizer: Optional[T5Tokenizer] = None, fast_tokenizer: Optional[T5TokenizerFast] = None) -> List[int]:
+    """
+    Compare fast and slow tokenizer output on texts and return the indices that differ.
+    """
+    slow_tokenizer = slow_tokenizer or T5Tokenizer.from_pretrained(TOKENIZER_NAME)
+    fast_ids = encode_texts(texts, fast_tokenizer)
+    mismatches = []
+    for i, text in enumerate(texts):
+        slow_ids = slow_tokenizer(text, add_special_tokens=False)['input_ids']
+        if list(fast_ids[i]) != slow_ids:
+            mismatches.append(i)
+    if mismatches:
+        logger.warning(f"Fast and slow tokenizers disagree on {len(mismatches)} of {len(texts)} text(s).")
+    else:
+        logger.info(f"Fast and slow tokenizers agree on all {len(texts)} text(s).")
+    return mismatches
@@ -0,0 +1,208 @@
+import os
+import logging
+import threading
+import itertools
+import multiprocessing
+from multiprocessing.connection import wait
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+import torch
+from generator import T5RAGWithLocalFiles
+from rag import generate_answer, load_model
+
+logger = logging.getLogger(__name__)
+
+# Number of model processes; 0 keeps the single in-process generator
+MODEL_WORKERS = int(os.getenv("MORTYRAG_MODEL_WORKERS", "0"))
+# How often the supervisor checks for crashed workers when no results arrive
+SUPERVISE_INTERVAL = 1.0
+
+# Model loaded in the parent before forking; workers inherit it copy-on-write
+_shared_model = None
+
+def partition_cores(num_workers: int) -> List[List[int]]:
+    """Split the cores this process may run on into num_workers disjoint sets."""
+    cores = sorted(os.sched_getaffinity(0))
+    num_workers = max(1, min(num_workers, len(cores)))
+    size, remainder = divmod(len(cores), num_workers)
+    sets, start = [], 0
+    for worker in range(num_workers):
+        stop = start + size + (1 if worker < remainder else 0)
+        sets.append(cores[start:stop])
+        start = stop
+    return sets
+
+def _worker_main(worker_index: int, cores: List[int], conn):
+    """Serve generate_answer requests received on conn in a worker pinned to its own cores."""
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    logger.info(f"Model worker {worker_index} (pid {os.getpid()}) pinned to cores {cores}.")
+
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        request_id, kwargs = request
+        try:
+            conn.send((request_id, True, generate_answer(model=_shared_model, **kwargs)))
+        except Exception as e:
+            conn.send((request_id, False, str(e)))
+    conn.close()
+
+class ModelWorkerPool:
+    """
+    Runs N forked model processes, each pinned to a disjoint set of cores, and routes
+    generate_answer requests to the least-loaded one.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, model_version: str = "v1.0", load_saved_model: bool = False, model: Optional[T5RAGWithLocalFiles] = None):
+        """
+        Loads the model once, unless one is passed in, and starts the workers.
+
+        Args:
+            num_workers (Optional[int]): Number of model processes. Defaults to MORTYRAG_MODEL_WORKERS or the core count.
+            model_version (str): Model version to serve.
+            load_saved_model (bool): Whether to serve a saved model version instead of t5-base.
+            model (Optional[T5RAGWithLocalFiles]): Model already loaded by the caller, served instead of loading another copy.
+        """
+        global _shared_model
+        # Workers are forked so they share the parent's weights instead of loading their own copy
+        self._context = multiprocessing.get_context("fork")
+        _shared_model = model if model is not None else load_model(model_version, load_saved_model)
+        _shared_model.eval()
+
+        self.model_version = model_version
+        self.load_saved_model = load_saved_model
+        self.core_sets = partition_cores(num_workers or MODEL_WORKERS or len(os.sched_getaffinity(0)))
+        self._processes = [None] * len(self.core_sets)
+        self._conns = [None] * len(self.core_sets)
+        self._pending: Dict[int, Future] = {}
+        self._assigned: Dict[int, int] = {}
+        self._load = [0] * len(self.core_sets)
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._running = True
+
+        for worker_index in range(len(self.core_sets)):
+            self._start_worker(worker_index)
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True)
+        self._supervisor.start()
+        logger.info(f"Started {len(self.core_sets)} model worker(s).")
+
+    def submit(self, query: str, **kwargs) -> Future:
+        """Queue a generate_answer call on the least-loaded worker and return a Future for its text."""
+        kwargs.setdefault("model_version", self.model_version)
+        kwargs.setdefault("load_saved_model", self.load_saved_model)
+        future = Future()
+        with self._lock:
+            if not self._running:
+                raise RuntimeError("Worker pool has been shut down.")
+            request_id = next(self._ids)
+            worker_index = min(range(len(self._load)), key=self._load.__getitem__)
+            self._pending[request_id] = future
+            self._assigned[request_id] = worker_index
+            self._load[worker_index] += 1
+            try:
+                self._conns[worker_index].send((request_id, dict(kwargs, query=query)))
+            except OSError:
+                # The worker is gone; the supervisor fails this request when it restarts the worker
+                logger.warning(f"Model worker {worker_index} is not accepting requests.")
+        return future
+
+    def generate_answer(self, query: str, **kwargs) -> str:
+        """Blocking equivalent of rag.generate_answer served by the pool."""
+        return self.submit(query, **kwargs).result()
+
+    def pids(self) -> List[int]:
+        """Process ids of the current workers."""
+        return [process.pid for process in self._processes]
+
+    def shutdown(self):
+        """Stop all workers after they finish their queued requests."""
+        with self._lock:
+            self._running = False
+            for conn in self._conns:
+                try:
+                    conn.send(None)
+                except OSError:
+                    pass
+        for process in self._processes:
+            process.join()
+        self._supervisor.join()
+        logger.info("Model worker pool shut down.")
+
+    def _start_worker(self, worker_index: int):
+        """Fork a worker process connected to the pool by a fresh pipe, closing the pipe of the worker it replaces."""
+        if self._conns[worker_index] is not None:
+            self._conns[worker_index].close()
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_index, self.core_sets[worker_index], child_conn),
+            # Daemonic so a crashed GUI never leaves workers behind; they scan the index in-process
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self._conns[worker_index] = parent_conn
+        self._processes[worker_index] = process
+
+    def _supervise(self):
+        """Resolve futures as results arrive and restart workers that die."""
+        while True:
+            ready = wait(list(self._conns) + [process.sentinel for process in self._processes], timeout=SUPERVISE_INTERVAL)
+            for conn in self._conns:
+                if conn not in ready:
+                    continue
+                try:
+                    self._deliver(*conn.recv())
+                except EOFError:
+                    # The worker died; _restart_crashed fails its requests
+                    continue
+            self._restart_crashed()
+            if not self._running and all(not process.is_alive() for process in self._processes):
+                self._drain()
+                break
+
+    def _deliver(self, request_id: int, ok: bool, payload):
+        """Resolve the future of a finished request."""
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+            worker_index = self._assigned.pop(request_id, None)
+            if worker_index is not None:
+                self._load[worker_index] -= 1
+        if future is not None:
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+    def _drain(self):
+        """Collect results still buffered after shutdown and fail anything left unanswered."""
+        for conn in self._conns:
+            try:
+                while conn.poll():
+                    self._deliver(*conn.recv())
+            except (EOFError, OSError):
+                pass
+        with self._lock:
+            for future in self._pending.values():
+                future.set_exception(RuntimeError("Worker pool shut down before the request finished."))
+            self._pending.clear()
+            self._assigned.clear()
+
+    def _restart_crashed(self):
+        """Fail the requests of any worker that exited unexpectedly and replace it."""
+        with self._lock:
+            if not self._running:
+                return
+            for worker_index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                logger.error(f"Model worker {worker_index} exited with code {process.exitcode}; restarting.")
+                lost = [request_id for request_id, assigned in self._assigned.items() if assigned == worker_index]
+                for request_id in lost:
+                    del self._assigned[request_id]
+                    self._pending.pop(request_id).set_exception(RuntimeError(f"Model worker {worker_index} crashed."))
+                self._load[worker_index] = 0
+                self._start_worker(worker_index)